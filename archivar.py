@@ -0,0 +1,26 @@
+import sys
+from datetime import datetime
+from sqlmodel import Session
+from db_config import engine, init_db
+from archivo import ARCHIVO_MESES, archivar_guias, fecha_corte
+
+# Inicializar la base de datos
+init_db()
+
+# Uso: python archivar.py [meses | YYYY-MM-DD]
+try:
+    if len(sys.argv) > 1 and "-" in sys.argv[1]:
+        corte = datetime.strptime(sys.argv[1], "%Y-%m-%d").date()
+    else:
+        corte = fecha_corte(int(sys.argv[1]) if len(sys.argv) > 1 else ARCHIVO_MESES)
+except ValueError:
+    print("Uso: python archivar.py [meses | YYYY-MM-DD]")
+    sys.exit(1)
+
+try:
+    with Session(engine) as session:
+        resultado = archivar_guias(session, corte)
+    print(f"Archivado completado: {resultado['guias']} guías y {resultado['items']} ítems anteriores a {corte}.")
+except Exception as e:
+    print(f"Error inesperado: {e}")
+    sys.exit(1)
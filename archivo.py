@@ -0,0 +1,177 @@
+import os
+import uuid
+from datetime import date
+from typing import List, Optional, Set, Tuple
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from sqlalchemy import tuple_
+from sqlmodel import Session, select
+from models import Guia, Item
+from borrado import LOTE_BORRADO, borrar_guias
+
+# Directorio del archivo histórico: una partición por mes (archivo/mes=YYYY-MM/*.parquet)
+ARCHIVO_DIR = os.getenv("ARCHIVO_DIR", "archivo")
+ARCHIVO_MESES = int(os.getenv("ARCHIVO_MESES", 6))  # Antigüedad por defecto para archivar
+
+# Esquema fijo de cada fila archivada: una fila por ítem con los datos de su guía.
+# Todas las partes se escriben y leen con él, aunque un lote tenga columnas vacías.
+ESQUEMA_ARCHIVO = pa.schema([
+    ("id_guid", pa.string()),
+    ("fecha", pa.date32()),
+    ("proveedor", pa.string()),
+    ("observacion", pa.string()),
+    ("tag", pa.string()),
+    ("descripcion", pa.string()),
+    ("cantidad", pa.int64()),
+    ("especialidad", pa.string()),
+])
+COLUMNAS_ARCHIVO = ESQUEMA_ARCHIVO.names
+
+
+def fecha_corte(meses: int = ARCHIVO_MESES, hoy: Optional[date] = None) -> date:
+    """Devuelve la fecha antes de la cual las guías se consideran históricas."""
+    hoy = hoy or date.today()
+    total = hoy.year * 12 + (hoy.month - 1) - meses
+    return date(total // 12, total % 12 + 1, 1)
+
+
+def _filas_guia(guia: Guia, items: List[Item]) -> List[dict]:
+    """Convierte una guía y sus ítems en filas del archivo."""
+    base = {
+        "id_guid": guia.id_guid,
+        "fecha": guia.fecha,
+        "proveedor": guia.proveedor,
+        "observacion": guia.observacion,
+    }
+    if not items:
+        # Se conserva la guía aunque no tenga ítems
+        return [dict(base, tag=None, descripcion=None, cantidad=None, especialidad=None)]
+    return [
+        dict(base, tag=item.tag, descripcion=item.descripcion, cantidad=item.cantidad, especialidad=item.especialidad)
+        for item in items
+    ]
+
+
+def _mes_siguiente(dia: date) -> date:
+    """Devuelve el primer día del mes siguiente."""
+    return date(dia.year + dia.month // 12, dia.month % 12 + 1, 1)
+
+
+def _escribir_mes(db: Session, desde: date, hasta: date, lote: int) -> Tuple[str, List[Tuple[str, Optional[str]]]]:
+    """Escribe en un solo archivo de la partición las guías con desde <= fecha < hasta y sus ítems.
+
+    Las filas se leen y se escriben por lotes de `lote`, sin cargar el mes completo en memoria.
+    Devuelve la ruta creada y las guías escritas como (id_guid, proveedor).
+    """
+    directorio = os.path.join(ARCHIVO_DIR, f"mes={desde:%Y-%m}")
+    os.makedirs(directorio, exist_ok=True)
+    ruta = os.path.join(directorio, f"part-{uuid.uuid4().hex}.parquet")
+    escritas = []
+    filas = []
+    ultima = None  # (fecha, id_guid) de la última guía leída
+    try:
+        with pq.ParquetWriter(ruta, ESQUEMA_ARCHIVO) as escritor:
+            while True:
+                consulta = select(Guia).where(Guia.fecha >= desde, Guia.fecha < hasta)
+                if ultima is not None:
+                    consulta = consulta.where(tuple_(Guia.fecha, Guia.id_guid) > tuple_(*ultima))
+                guias = {g.id_guid: g for g in db.exec(consulta.order_by(Guia.fecha, Guia.id_guid).limit(lote))}
+                if not guias:
+                    break
+                ultima = max((g.fecha, g.id_guid) for g in guias.values())
+
+                con_items = set()
+                items = db.exec(select(Item).where(Item.id_guid.in_(list(guias))).execution_options(yield_per=lote))
+                for item in items:
+                    con_items.add(item.id_guid)
+                    filas.extend(_filas_guia(guias[item.id_guid], [item]))
+                    if len(filas) >= lote:
+                        escritor.write_table(pa.Table.from_pylist(filas, schema=ESQUEMA_ARCHIVO))
+                        filas = []
+                for id_guid, guia in guias.items():
+                    if id_guid not in con_items:
+                        filas.extend(_filas_guia(guia, []))
+                escritas.extend((g.id_guid, g.proveedor) for g in guias.values())
+            if filas:
+                escritor.write_table(pa.Table.from_pylist(filas, schema=ESQUEMA_ARCHIVO))
+    except Exception:
+        if os.path.exists(ruta):
+            os.remove(ruta)
+        raise
+    return ruta, escritas
+
+
+def _conservar_guias(ruta: str, guias: Set[str]) -> None:
+    """Deja en el archivo solo las filas de las guías indicadas (lo demás sigue en la base)."""
+    tabla = pq.read_table(ruta, schema=ESQUEMA_ARCHIVO)
+    tabla = tabla.filter(pc.is_in(tabla["id_guid"], value_set=pa.array(list(guias), pa.string())))
+    if tabla.num_rows:
+        pq.write_table(tabla, ruta)
+    else:
+        os.remove(ruta)
+
+
+def archivar_guias(db: Session, corte: date, lote: int = LOTE_BORRADO) -> dict:
+    """Mueve las guías anteriores a la fecha de corte (con sus ítems) al archivo Parquet.
+
+    Las guías se recorren por fecha, un mes a la vez: el mes se escribe en un solo archivo de su
+    partición y recién después se borra de la base, en transacciones de como mucho `lote` filas.
+    """
+    total_guias = 0
+    total_items = 0
+    while True:
+        primera = db.exec(select(Guia.fecha).where(Guia.fecha < corte).order_by(Guia.fecha).limit(1)).first()
+        if primera is None:
+            break
+
+        desde = primera.replace(day=1)
+        ruta, guias = _escribir_mes(db, desde, min(_mes_siguiente(desde), corte), lote)
+        # Si el borrado falla, el archivo conserva solo las guías que ya salieron de la base
+        tocadas: Set[str] = set()
+        try:
+            for i in range(0, len(guias), lote):
+                total_items += borrar_guias(db, guias[i:i + lote], lote, operacion="archivado", tocadas=tocadas)
+        except Exception:
+            db.rollback()
+            _conservar_guias(ruta, tocadas)
+            raise
+        total_guias += len(guias)
+    return {"guias": total_guias, "items": total_items}
+
+
+def leer_archivo(id_guid: Optional[str] = None) -> pd.DataFrame:
+    """Lee las filas archivadas, opcionalmente solo las de una guía."""
+    if not os.path.isdir(ARCHIVO_DIR) or not os.listdir(ARCHIVO_DIR):
+        return pd.DataFrame(columns=COLUMNAS_ARCHIVO)
+
+    filtros = [("id_guid", "==", id_guid)] if id_guid is not None else None
+    tabla = pq.read_table(ARCHIVO_DIR, schema=ESQUEMA_ARCHIVO, filters=filtros)
+    return tabla.to_pandas()[COLUMNAS_ARCHIVO]
+
+
+def buscar_guia_archivada(id_guid: str):
+    """Reconstruye una guía archivada y sus ítems; devuelve (None, []) si no está en el archivo."""
+    df = leer_archivo(id_guid=id_guid)
+    if df.empty:
+        return None, []
+    df = df.astype(object).where(df.notna(), None)  # Los valores vacíos vuelven como None, no NaN
+    fila = df.iloc[0]
+    guia = Guia(
+        id_guid=fila["id_guid"],
+        fecha=pd.Timestamp(fila["fecha"]).date(),
+        proveedor=fila["proveedor"],
+        observacion=fila["observacion"]
+    )
+    items = [
+        Item(
+            tag=f["tag"],
+            descripcion=f["descripcion"],
+            cantidad=int(f["cantidad"]),
+            especialidad=f["especialidad"],
+            id_guid=id_guid
+        )
+        for f in df.dropna(subset=["tag"]).to_dict("records")
+    ]
+    return guia, items
@@ -0,0 +1,271 @@
+import sys
+import heapq
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+from sqlalchemy import func
+from sqlmodel import Session, select
+from models import Guia, Item
+
+TAMANO_BLOQUE = 1024  # Claves por bloque; un bloque se divide al superar el doble
+K_MAXIMO = 50
+
+# Cómo recuperar el valor original a partir de la clave normalizada (casefold)
+IGUAL, MAYUSCULAS, OTRO = 0, 1, 2
+
+
+def _forma(valor: str, clave: str) -> int:
+    if valor == clave:
+        return IGUAL
+    if valor == clave.upper():
+        return MAYUSCULAS
+    return OTRO
+
+
+class _Bloque:
+    """Tramo ordenado del índice con sus valores más frecuentes precalculados.
+
+    Solo se guarda la clave normalizada; el valor original se guarda aparte únicamente cuando
+    no es la misma clave ni la clave en mayúsculas.
+    """
+
+    __slots__ = ("claves", "formas", "otros", "frecuencias", "top")
+
+    def __init__(self, claves: List[str], formas: array, otros: Dict[str, str], frecuencias: array):
+        self.claves = claves
+        self.formas = formas
+        self.otros = otros
+        self.frecuencias = frecuencias
+        self.actualizar_top()
+
+    def valor(self, i: int) -> str:
+        """Devuelve el valor original de la posición i."""
+        forma = self.formas[i]
+        if forma == IGUAL:
+            return self.claves[i]
+        if forma == MAYUSCULAS:
+            return self.claves[i].upper()
+        return self.otros[self.claves[i]]
+
+    def actualizar_top(self) -> None:
+        """Recalcula los K_MAXIMO valores más frecuentes del bloque."""
+        self.top = self.rango(0, len(self.claves), K_MAXIMO)
+
+    def rango(self, inicio: int, fin: int, k: int) -> List[Tuple[int, str]]:
+        """Devuelve los k valores más frecuentes entre las posiciones inicio y fin."""
+        mejores = heapq.nlargest(k, range(inicio, fin), key=self.frecuencias.__getitem__)
+        return [(self.frecuencias[i], self.valor(i)) for i in mejores]
+
+    def dividir(self, m: int) -> "_Bloque":
+        """Separa las claves desde la posición m en un bloque nuevo."""
+        claves = self.claves[m:]
+        otros = {c: self.otros.pop(c) for c in claves if c in self.otros}
+        nuevo = _Bloque(claves, self.formas[m:], otros, self.frecuencias[m:])
+        del self.claves[m:], self.formas[m:], self.frecuencias[m:]
+        self.actualizar_top()
+        return nuevo
+
+
+class IndicePrefijos:
+    """Índice ordenado en bloques de arreglos para sugerir valores por prefijo, ordenados por frecuencia."""
+
+    def __init__(self, valores: Iterable[Tuple[str, int]] = ()):
+        self._lock = threading.Lock()
+        acumulado: Dict[str, Tuple[str, int]] = {}
+        for valor, frecuencia in valores:
+            valor = (valor or "").strip()
+            if not valor:
+                continue
+            clave = valor.casefold()
+            anterior = acumulado.get(clave)
+            acumulado[clave] = (anterior[0] if anterior else valor, (anterior[1] if anterior else 0) + frecuencia)
+        ordenadas = sorted(acumulado)
+        self._bloques: List[_Bloque] = []
+        for i in range(0, len(ordenadas), TAMANO_BLOQUE):
+            tramo = ordenadas[i:i + TAMANO_BLOQUE]
+            formas = array("B", (_forma(acumulado[c][0], c) for c in tramo))
+            otros = {c: acumulado[c][0] for c, f in zip(tramo, formas) if f == OTRO}
+            self._bloques.append(_Bloque(tramo, formas, otros, array("L", (acumulado[c][1] for c in tramo))))
+        # Primera clave de cada bloque, para ubicar bloques con búsqueda binaria
+        self._primeras: List[str] = [b.claves[0] for b in self._bloques]
+
+    def __len__(self) -> int:
+        return sum(len(b.claves) for b in self._bloques)
+
+    def agregar(self, valor: str, cantidad: int = 1) -> None:
+        """Registra una nueva aparición del valor (inserción incremental)."""
+        valor = (valor or "").strip()
+        if not valor:
+            return
+        clave = valor.casefold()
+        forma = _forma(valor, clave)
+        with self._lock:
+            if not self._bloques:
+                otros = {clave: valor} if forma == OTRO else {}
+                self._bloques.append(_Bloque([clave], array("B", [forma]), otros, array("L", [cantidad])))
+                self._primeras.append(clave)
+                return
+            b = max(bisect_right(self._primeras, clave) - 1, 0)
+            bloque = self._bloques[b]
+            i = bisect_left(bloque.claves, clave)
+            if i < len(bloque.claves) and bloque.claves[i] == clave:
+                bloque.frecuencias[i] += cantidad
+            else:
+                bloque.claves.insert(i, clave)
+                bloque.formas.insert(i, forma)
+                bloque.frecuencias.insert(i, cantidad)
+                if forma == OTRO:
+                    bloque.otros[clave] = valor
+                self._primeras[b] = bloque.claves[0]
+            if len(bloque.claves) > 2 * TAMANO_BLOQUE:
+                nuevo = bloque.dividir(TAMANO_BLOQUE)
+                self._bloques.insert(b + 1, nuevo)
+                self._primeras.insert(b + 1, nuevo.claves[0])
+            else:
+                bloque.actualizar_top()
+
+    def quitar(self, valor: str, cantidad: int = 1) -> None:
+        """Descuenta apariciones del valor; si llega a cero deja de sugerirse."""
+        valor = (valor or "").strip()
+        if not valor:
+            return
+        clave = valor.casefold()
+        with self._lock:
+            if not self._bloques:
+                return
+            b = max(bisect_right(self._primeras, clave) - 1, 0)
+            bloque = self._bloques[b]
+            i = bisect_left(bloque.claves, clave)
+            if i >= len(bloque.claves) or bloque.claves[i] != clave:
+                return
+            if bloque.frecuencias[i] > cantidad:
+                bloque.frecuencias[i] -= cantidad
+            else:
+                del bloque.claves[i], bloque.formas[i], bloque.frecuencias[i]
+                bloque.otros.pop(clave, None)
+                if not bloque.claves:
+                    del self._bloques[b], self._primeras[b]
+                    return
+                self._primeras[b] = bloque.claves[0]
+            bloque.actualizar_top()
+
+    def sugerir(self, prefijo: str, k: int = 10) -> List[Tuple[str, int]]:
+        """Devuelve hasta k valores que empiezan con el prefijo, de mayor a menor frecuencia."""
+        prefijo = (prefijo or "").strip().casefold()
+        k = max(1, min(k, K_MAXIMO))
+        if not prefijo:
+            return []
+        limite = prefijo + "\uffff"
+        with self._lock:
+            primero = max(bisect_right(self._primeras, prefijo) - 1, 0)
+            ultimo = bisect_left(self._primeras, limite)
+            listas = []
+            for bloque in self._bloques[primero:ultimo]:
+                if bloque.claves[0] >= prefijo and bloque.claves[-1] < limite:
+                    # Bloque completo dentro del rango: se usan sus valores precalculados
+                    listas.append(bloque.top)
+                else:
+                    inicio = bisect_left(bloque.claves, prefijo)
+                    fin = bisect_left(bloque.claves, limite, inicio)
+                    if inicio < fin:
+                        listas.append(bloque.rango(inicio, fin, k))
+            # Cada lista está ordenada de mayor a menor: un heap con la cabeza de cada una basta
+            heap = [(-lista[0][0], n, 0) for n, lista in enumerate(listas)]
+            heapq.heapify(heap)
+            resultado = []
+            while heap and len(resultado) < k:
+                _, n, pos = heapq.heappop(heap)
+                frecuencia, valor = listas[n][pos]
+                resultado.append((valor, frecuencia))
+                if pos + 1 < len(listas[n]):
+                    heapq.heappush(heap, (-listas[n][pos + 1][0], n, pos + 1))
+            return resultado
+
+    def memoria(self) -> int:
+        """Estima los bytes usados por el índice (arreglos, cadenas y valores precalculados)."""
+        total = sys.getsizeof(self._bloques) + sys.getsizeof(self._primeras)
+        for b in self._bloques:
+            total += sys.getsizeof(b.claves) + sys.getsizeof(b.top) + sys.getsizeof(b.otros)
+            total += b.frecuencias.itemsize * len(b.frecuencias) + b.formas.itemsize * len(b.formas)
+            total += sum(sys.getsizeof(c) for c in b.claves)
+            total += sum(sys.getsizeof(v) for v in b.otros.values())
+            total += sum(sys.getsizeof(t) + sys.getsizeof(t[1]) for t in b.top)
+        return total
+
+
+# Campos con autocompletado: campo -> columna del modelo
+CAMPOS_AUTOCOMPLETADO = {
+    "tag": Item.tag,
+    "descripcion": Item.descripcion,
+    "especialidad": Item.especialidad,
+    "proveedor": Guia.proveedor,
+}
+
+indices: Dict[str, IndicePrefijos] = {campo: IndicePrefijos() for campo in CAMPOS_AUTOCOMPLETADO}
+
+
+def construir_indices(db: Session) -> None:
+    """Reconstruye los índices a partir de los valores distintos de la base de datos."""
+    for campo, columna in CAMPOS_AUTOCOMPLETADO.items():
+        filas = db.exec(select(columna, func.count()).group_by(columna)).all()
+        indices[campo] = IndicePrefijos(filas)
+
+
+def valores_autocompletado(guias: Iterable[Guia] = (), items: Iterable[Item] = ()) -> Dict[str, List[Optional[str]]]:
+    """Extrae de guías e ítems los valores de cada campo con autocompletado.
+
+    Debe llamarse antes del commit: después los objetos quedan expirados y leer cada atributo
+    volvería a consultar su fila.
+    """
+    guias, items = list(guias), list(items)
+    return {
+        "proveedor": [g.proveedor for g in guias],
+        "tag": [i.tag for i in items],
+        "descripcion": [i.descripcion for i in items],
+        "especialidad": [i.especialidad for i in items],
+    }
+
+
+def indexar(valores: Dict[str, Iterable[Optional[str]]]) -> None:
+    """Suma a los índices los valores de las filas recién guardadas (campo -> valores)."""
+    for campo, lista in valores.items():
+        for valor, cantidad in Counter(v for v in lista if v).items():
+            indices[campo].agregar(valor, cantidad)
+
+
+def desindexar(valores: Dict[str, Iterable[Optional[str]]]) -> None:
+    """Descuenta de los índices los valores de las filas eliminadas (campo -> valores)."""
+    for campo, lista in valores.items():
+        for valor, cantidad in Counter(v for v in lista if v).items():
+            indices[campo].quitar(valor, cantidad)
+
+
+if __name__ == "__main__":
+    # Medición con un millón de claves distintas
+    import random
+    import time
+
+    random.seed(0)
+    n = 1_000_000
+    inicio = time.perf_counter()
+    indice = IndicePrefijos((f"TAG-{i:07d}-{random.choice('ABCDEFGH')}", random.randint(1, 100)) for i in range(n))
+    print(f"Construcción: {time.perf_counter() - inicio:.2f} s, {len(indice)} claves")
+    print(f"Memoria estimada: {indice.memoria() / 1024 / 1024:.1f} MiB")
+
+    for prefijo in ["T", "TAG-0", "TAG-01", "TAG-0123", "TAG-012345"]:
+        inicio = time.perf_counter()
+        indice.sugerir(prefijo)
+        primera = (time.perf_counter() - inicio) * 1000
+        repeticiones = 200
+        tiempos = []
+        for _ in range(repeticiones):
+            inicio = time.perf_counter()
+            indice.sugerir(prefijo)
+            tiempos.append((time.perf_counter() - inicio) * 1000)
+        print(f"sugerir({prefijo!r}): primera {primera:.3f} ms, media {sum(tiempos) / repeticiones:.3f} ms, máx {max(tiempos):.3f} ms")
+
+    inicio = time.perf_counter()
+    indice.agregar("TAG-NUEVO")
+    print(f"agregar: {(time.perf_counter() - inicio) * 1000:.3f} ms")
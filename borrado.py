@@ -0,0 +1,158 @@
+import os
+import time
+import logging
+from datetime import date
+from typing import Iterator, List, Optional, Set, Tuple
+from sqlalchemy import delete, func, text, tuple_
+from sqlmodel import Session, select
+from models import Guia, Item
+from cambios import registrar_borrados, registrar_vaciado
+from autocompletado import desindexar
+
+logger = logging.getLogger(__name__)
+
+PDF_DIR = "static/pdf"
+LOTE_BORRADO = 500  # Filas por transacción: mantiene corto el bloqueo de escritura
+
+
+def _eliminar_pdf(id_guid: str) -> bool:
+    """Elimina el PDF asociado a la guía, si existe."""
+    ruta = os.path.join(PDF_DIR, f"{id_guid}.pdf")
+    if os.path.exists(ruta):
+        os.remove(ruta)
+        return True
+    return False
+
+
+def _progreso(guias: int, items: int, pdfs: int, inicio: float, terminado: bool = False) -> dict:
+    segundos = time.perf_counter() - inicio
+    return {
+        "guias": guias,
+        "items": items,
+        "pdfs": pdfs,
+        "segundos": round(segundos, 3),
+        "filas_por_segundo": round((guias + items) / segundos, 1) if segundos > 0 else None,
+        "terminado": terminado,
+    }
+
+
+def borrar_guias(
+    db: Session,
+    guias: List[Tuple[str, Optional[str]]],
+    lote: int = LOTE_BORRADO,
+    operacion: str = "delete",
+    tocadas: Optional[Set[str]] = None,
+) -> int:
+    """Borra las guías indicadas (id_guid, proveedor) con sus ítems y devuelve los ítems borrados.
+
+    Los ítems se borran en transacciones de como mucho `lote` filas y las guías justo después,
+    descontando los valores de los índices de autocompletado. Si se entrega `tocadas`, se le
+    agregan las guías que ya perdieron filas en transacciones confirmadas.
+    """
+    ids = [g for g, _ in guias]
+    total_items = 0
+    while True:
+        filas = db.exec(
+            select(Item.id, Item.id_guid, Item.tag, Item.descripcion, Item.especialidad)
+            .where(Item.id_guid.in_(ids))
+            .limit(lote)
+        ).all()
+        if not filas:
+            break
+
+        ids_items = [f[0] for f in filas]
+        db.exec(delete(Item).where(Item.id.in_(ids_items)))
+        registrar_borrados(db, "item", ids_items, operacion)
+        db.commit()
+
+        if tocadas is not None:
+            tocadas.update(f[1] for f in filas)
+        desindexar({
+            "tag": [f[2] for f in filas],
+            "descripcion": [f[3] for f in filas],
+            "especialidad": [f[4] for f in filas],
+        })
+        total_items += len(ids_items)
+
+    db.exec(delete(Guia).where(Guia.id_guid.in_(ids)))
+    registrar_borrados(db, "guia", ids, operacion)
+    db.commit()
+
+    if tocadas is not None:
+        tocadas.update(ids)
+    desindexar({"proveedor": [p for _, p in guias]})
+    return total_items
+
+
+def eliminar_guias(
+    db: Session,
+    id_guid: Optional[str] = None,
+    desde: Optional[date] = None,
+    hasta: Optional[date] = None,
+    proveedor: Optional[str] = None,
+    lote: int = LOTE_BORRADO,
+) -> Iterator[dict]:
+    """Elimina por lotes las guías que cumplen los filtros, con sus ítems y PDFs.
+
+    Las guías se recorren una sola vez por (fecha, id_guid) en tramos de `lote`; cada tramo se
+    borra completo (ítems y luego guías, en transacciones de como mucho `lote` filas) antes de
+    entregar el progreso, así cortar el borrado no deja guías sin sus ítems.
+    """
+    condiciones = []
+    if id_guid is not None:
+        condiciones.append(Guia.id_guid == id_guid)
+    if desde is not None:
+        condiciones.append(Guia.fecha >= desde)
+    if hasta is not None:
+        condiciones.append(Guia.fecha <= hasta)
+    if proveedor is not None:
+        condiciones.append(Guia.proveedor == proveedor)
+    if not condiciones:
+        raise ValueError("Debe indicar al menos un filtro; para borrar todo use vaciar_todo.")
+
+    inicio = time.perf_counter()
+    total_guias = total_items = total_pdfs = 0
+    ultima = None  # (fecha, id_guid) de la última guía borrada: la consulta sigue desde ahí
+
+    while True:
+        consulta = select(Guia.fecha, Guia.id_guid, Guia.proveedor).where(*condiciones)
+        if ultima is not None:
+            consulta = consulta.where(tuple_(Guia.fecha, Guia.id_guid) > tuple_(*ultima))
+        guias = db.exec(consulta.order_by(Guia.fecha, Guia.id_guid).limit(lote)).all()
+        if not guias:
+            break
+
+        ultima = (guias[-1][0], guias[-1][1])
+        total_items += borrar_guias(db, [(g[1], g[2]) for g in guias], lote)
+
+        # Los PDFs se eliminan solo después de confirmar el borrado de las guías
+        total_pdfs += sum(_eliminar_pdf(g[1]) for g in guias)
+        total_guias += len(guias)
+        progreso = _progreso(total_guias, total_items, total_pdfs, inicio)
+        logger.info(f"Borrado en curso: {progreso}")
+        yield progreso
+
+    yield _progreso(total_guias, total_items, total_pdfs, inicio, terminado=True)
+
+
+def vaciar_todo(db: Session) -> dict:
+    """Elimina todas las guías e ítems de una vez (truncado rápido) junto con todos los PDFs."""
+    inicio = time.perf_counter()
+    total_items = db.exec(select(func.count(Item.id))).one()
+    total_guias = db.exec(select(func.count(Guia.id_guid))).one()
+    if db.get_bind().dialect.name == "postgresql":
+        db.exec(text("TRUNCATE TABLE item, guia;"))
+    else:
+        # En SQLite un DELETE sin WHERE usa la optimización de truncado y no recorre las filas
+        db.exec(text("DELETE FROM item;"))
+        db.exec(text("DELETE FROM guia;"))
+    registrar_vaciado(db)
+    db.commit()
+
+    total_pdfs = 0
+    if os.path.isdir(PDF_DIR):
+        for nombre in os.listdir(PDF_DIR):
+            if nombre.endswith(".pdf"):
+                os.remove(os.path.join(PDF_DIR, nombre))
+                total_pdfs += 1
+    return _progreso(total_guias, total_items, total_pdfs, inicio, terminado=True)
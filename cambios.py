@@ -0,0 +1,147 @@
+import logging
+from typing import Callable, Dict, List, Optional, Tuple
+from sqlalchemy import event, func, inspect
+from sqlmodel import Session, select
+from models import Cambio, Guia, Item, ahora_utc
+
+logger = logging.getLogger(__name__)
+
+# Tablas cuyo historial de cambios se registra
+TABLAS_SEGUIDAS = (Guia, Item)
+
+_registrado = False
+suscriptores_commit: List[Callable[[], None]] = []
+
+
+def _clave(obj) -> str:
+    """Devuelve la clave primaria del objeto como texto."""
+    return str(obj.id_guid if isinstance(obj, Guia) else obj.id)
+
+
+def _antes_de_flush(session, flush_context, instances):
+    """Actualiza las marcas de tiempo de las guías e ítems creados o modificados."""
+    ahora = ahora_utc()
+    for obj in session.new:
+        if isinstance(obj, TABLAS_SEGUIDAS):
+            obj.creado = obj.creado or ahora
+            obj.actualizado = ahora
+    for obj in session.dirty:
+        if isinstance(obj, TABLAS_SEGUIDAS) and session.is_modified(obj, include_collections=False):
+            obj.actualizado = ahora
+
+
+def _despues_de_flush(session, flush_context):
+    """Registra en la tabla de cambios las filas insertadas, modificadas o eliminadas."""
+    ahora = ahora_utc()
+    motivo_borrado = session.info.get("motivo_borrado", "delete")
+    filas = []
+    for coleccion, operacion in ((session.new, "insert"), (session.dirty, "update"), (session.deleted, motivo_borrado)):
+        for obj in coleccion:
+            if not isinstance(obj, TABLAS_SEGUIDAS):
+                continue
+            if operacion == "update" and not session.is_modified(obj, include_collections=False):
+                continue
+            filas.append({"tabla": obj.__tablename__, "clave": _clave(obj), "operacion": operacion, "fecha": ahora})
+    if filas:
+        # Se inserta en la misma transacción, sin pasar por la unidad de trabajo en curso
+        session.connection().execute(Cambio.__table__.insert(), filas)
+        session.info["hubo_cambios"] = True
+
+
+def _despues_de_commit(session):
+    """Avisa a los suscriptores cuando se confirma una transacción con cambios en guías o ítems."""
+    if not session.info.pop("hubo_cambios", False):
+        return
+    for funcion in suscriptores_commit:
+        try:
+            funcion()
+        except Exception as e:
+            logger.error(f"Error al notificar un cambio confirmado: {e}")
+
+
+def _despues_de_rollback(session, transaccion_anterior):
+    session.info.pop("hubo_cambios", None)
+
+
+def al_confirmar(funcion: Callable[[], None]) -> None:
+    """Registra una función que se llama después de cada commit con cambios en guías o ítems."""
+    suscriptores_commit.append(funcion)
+
+
+def registrar_cambios() -> None:
+    """Activa el registro de cambios para todas las sesiones."""
+    global _registrado
+    if _registrado:
+        return
+    event.listen(Session, "before_flush", _antes_de_flush)
+    event.listen(Session, "after_flush", _despues_de_flush)
+    event.listen(Session, "after_commit", _despues_de_commit)
+    event.listen(Session, "after_soft_rollback", _despues_de_rollback)
+    _registrado = True
+
+
+def registrar_vaciado(db: Session, tabla: str = "*") -> None:
+    """Registra un borrado masivo hecho con SQL directo, que no pasa por los eventos de la sesión."""
+    db.add(Cambio(tabla=tabla, clave="*", operacion="vaciado"))
+    db.info["hubo_cambios"] = True
+
+
+def registrar_borrados(db: Session, tabla: str, claves: List[str], operacion: str = "delete") -> None:
+    """Registra filas borradas con SQL directo (por lotes), que no pasan por los eventos de la sesión."""
+    if not claves:
+        return
+    ahora = ahora_utc()
+    db.connection().execute(
+        Cambio.__table__.insert(),
+        [{"tabla": tabla, "clave": str(c), "operacion": operacion, "fecha": ahora} for c in claves]
+    )
+    db.info["hubo_cambios"] = True
+
+
+def cursor_actual(db: Session) -> int:
+    """Devuelve el último cursor del registro de cambios (0 si está vacío)."""
+    return db.exec(select(func.max(Cambio.id))).one() or 0
+
+
+def cambios_desde(db: Session, cursor: int, limite: int) -> Tuple[List[Cambio], bool]:
+    """Devuelve una página de cambios posteriores al cursor, con el último cambio de cada fila."""
+    pagina = db.exec(select(Cambio).where(Cambio.id > cursor).order_by(Cambio.id).limit(limite + 1)).all()
+    hay_mas = len(pagina) > limite
+    ultimos: Dict[Tuple[str, str], Cambio] = {}
+    for cambio in pagina[:limite]:
+        ultimos.pop((cambio.tabla, cambio.clave), None)
+        ultimos[(cambio.tabla, cambio.clave)] = cambio
+    return list(ultimos.values()), hay_mas
+
+
+def ultimas_operaciones(db: Session, desde: int, hasta: int) -> Dict[Tuple[str, str], str]:
+    """Devuelve la última operación de cada fila cambiada entre los cursores desde (excluido) y hasta."""
+    operaciones: Dict[Tuple[str, str], str] = {}
+    consulta = select(Cambio).where(Cambio.id > desde, Cambio.id <= hasta).order_by(Cambio.id)
+    for cambio in db.exec(consulta):
+        operaciones.pop((cambio.tabla, cambio.clave), None)
+        operaciones[(cambio.tabla, cambio.clave)] = cambio.operacion
+    return operaciones
+
+
+def cargar_filas(db: Session, cambios: List[Cambio]) -> Dict[Tuple[str, str], Optional[dict]]:
+    """Obtiene el estado actual de las filas cambiadas con una consulta por tabla."""
+    claves_guia = [c.clave for c in cambios if c.tabla == "guia" and c.operacion in ("insert", "update")]
+    claves_item = [int(c.clave) for c in cambios if c.tabla == "item" and c.operacion in ("insert", "update")]
+    filas = {}
+    if claves_guia:
+        for guia in db.exec(select(Guia).where(Guia.id_guid.in_(claves_guia))).all():
+            filas[("guia", guia.id_guid)] = _a_dict(guia)
+    if claves_item:
+        for item in db.exec(select(Item).where(Item.id.in_(claves_item))).all():
+            filas[("item", str(item.id))] = _a_dict(item)
+    return filas
+
+
+def _a_dict(obj) -> dict:
+    """Convierte una fila en un diccionario serializable en JSON."""
+    datos = {}
+    for columna in inspect(obj).mapper.column_attrs:
+        valor = getattr(obj, columna.key)
+        datos[columna.key] = valor.isoformat() if hasattr(valor, "isoformat") else valor
+    return datos
@@ -1,5 +1,7 @@
 import os
+from sqlalchemy import inspect, text
 from sqlmodel import SQLModel, create_engine, Session
+from cambios import registrar_cambios
 
 # Configuración de la base de datos
 DATABASE_URL = "sqlite:///bodega.db"  # Cambia esto si usas otra base de datos
@@ -8,8 +10,29 @@ engine = create_engine(DATABASE_URL, echo=True)
 def init_db():
     """Inicializa la base de datos creando las tablas necesarias."""
     SQLModel.metadata.create_all(engine)
+    agregar_columnas_faltantes()
+    crear_indices_faltantes()
+    registrar_cambios()
+
+def agregar_columnas_faltantes():
+    """Agrega a las tablas existentes las columnas nuevas de los modelos (siempre opcionales)."""
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for tabla in SQLModel.metadata.sorted_tables:
+            existentes = {c["name"] for c in inspector.get_columns(tabla.name)}
+            for columna in tabla.columns:
+                if columna.name not in existentes:
+                    tipo = columna.type.compile(dialect=engine.dialect)
+                    conn.execute(text(f'ALTER TABLE {tabla.name} ADD COLUMN {columna.name} {tipo}'))
+
+def crear_indices_faltantes():
+    """Crea en las tablas existentes los índices nuevos de los modelos."""
+    with engine.begin() as conn:
+        for tabla in SQLModel.metadata.sorted_tables:
+            for indice in tabla.indexes:
+                indice.create(conn, checkfirst=True)
 
 def get_session():
     """Obtiene una sesión de la base de datos."""
     with Session(engine) as session:
-        yield session
\ No newline at end of file
+        yield session
@@ -0,0 +1,117 @@
+import asyncio
+import logging
+from typing import Callable, Optional, Set
+from sqlalchemy import func
+from sqlmodel import Session, select
+from db_config import engine
+from models import Guia, Item
+
+logger = logging.getLogger(__name__)
+
+RECIENTES = 10  # Guías recientes que se muestran en el dashboard
+
+
+def calcular_estadisticas() -> dict:
+    """Calcula los ítems por especialidad y las guías más recientes."""
+    with Session(engine) as db:
+        filas = db.exec(select(Item.especialidad, func.count()).group_by(Item.especialidad)).all()
+        recientes = db.exec(select(Guia).order_by(Guia.creado.desc()).limit(RECIENTES)).all()
+    return {
+        "especialidades": {(e or "No especificada"): n for e, n in filas},
+        "recientes": [
+            {"id_guid": g.id_guid, "fecha": g.fecha.isoformat(), "proveedor": g.proveedor}
+            for g in recientes
+        ],
+    }
+
+
+def diferencia(anterior: dict, actual: dict) -> dict:
+    """Devuelve solo lo que cambió entre dos estadísticas (especialidades eliminadas quedan en 0)."""
+    delta = {}
+    especialidades = {
+        e: actual["especialidades"].get(e, 0)
+        for e in set(anterior["especialidades"]) | set(actual["especialidades"])
+        if anterior["especialidades"].get(e) != actual["especialidades"].get(e)
+    }
+    if especialidades:
+        delta["especialidades"] = especialidades
+    if anterior["recientes"] != actual["recientes"]:
+        delta["recientes"] = actual["recientes"]
+    return delta
+
+
+class DifusorEstadisticas:
+    """Reparte a todos los clientes conectados los cambios de las estadísticas.
+
+    Los avisos de cambio que llegan dentro de `intervalo` se agrupan en un solo cálculo, y cada
+    cliente tiene una cola acotada: si no la vacía a tiempo se le desconecta para que vuelva a
+    conectarse y reciba el estado completo.
+    """
+
+    def __init__(self, calcular: Callable[[], dict], intervalo: float = 0.5, max_cola: int = 16):
+        self._calcular = calcular
+        self._intervalo = intervalo
+        self._max_cola = max_cola
+        self._clientes: Set[asyncio.Queue] = set()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._pendiente = False
+        self._actual: Optional[dict] = None
+
+    async def suscribir(self) -> asyncio.Queue:
+        """Registra un cliente y le entrega el estado completo como primer evento."""
+        self._loop = asyncio.get_running_loop()
+        if self._actual is None:
+            self._actual = await self._loop.run_in_executor(None, self._calcular)
+        cola: asyncio.Queue = asyncio.Queue(maxsize=self._max_cola)
+        cola.put_nowait(("snapshot", self._actual))
+        self._clientes.add(cola)
+        return cola
+
+    def desuscribir(self, cola: asyncio.Queue) -> None:
+        """Elimina un cliente."""
+        self._clientes.discard(cola)
+
+    def notificar(self) -> None:
+        """Avisa que hubo un cambio; puede llamarse desde cualquier hilo."""
+        if self._loop is None or self._loop.is_closed() or not self._clientes:
+            # Sin clientes el estado guardado queda obsoleto: se recalcula en la próxima suscripción
+            self._actual = None
+            return
+        self._loop.call_soon_threadsafe(self._programar)
+
+    def _programar(self) -> None:
+        if self._pendiente:
+            return
+        self._pendiente = True
+        self._loop.call_later(self._intervalo, lambda: asyncio.ensure_future(self._emitir()))
+
+    async def _emitir(self) -> None:
+        self._pendiente = False
+        try:
+            actual = await self._loop.run_in_executor(None, self._calcular)
+        except Exception as e:
+            logger.error(f"Error al calcular las estadísticas: {e}")
+            return
+        anterior, self._actual = self._actual, actual
+        delta = diferencia(anterior, actual) if anterior else actual
+        if delta:
+            self._publicar(("delta", delta))
+
+    def _publicar(self, evento) -> None:
+        for cola in list(self._clientes):
+            try:
+                cola.put_nowait(evento)
+            except asyncio.QueueFull:
+                # Cliente lento: se vacía su cola y se le indica que termine
+                self._clientes.discard(cola)
+                while not cola.empty():
+                    cola.get_nowait()
+                cola.put_nowait(None)
+                logger.warning("Cliente de estadísticas desconectado por no consumir eventos a tiempo.")
+
+    @property
+    def clientes(self) -> int:
+        return len(self._clientes)
+
+
+difusor = DifusorEstadisticas(calcular_estadisticas)
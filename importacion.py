@@ -0,0 +1,171 @@
+import os
+import re
+import json
+import time
+import uuid
+import shutil
+from datetime import datetime, date
+from typing import Dict, List, Optional, Tuple
+from dateutil.parser import parse
+from openpyxl import load_workbook
+from sqlmodel import Session, select
+from models import PerfilColumnas
+
+# Directorio donde se guardan los archivos subidos a la espera de confirmación
+UPLOAD_DIR = "uploads"
+STAGED_TTL_SEGUNDOS = 24 * 60 * 60  # Los archivos sin confirmar se eliminan después de un día
+_TOKEN_RE = re.compile(r"^[0-9a-f]{32}$")
+
+# Cabeceras requeridas y sus equivalentes
+ALIAS_COLUMNAS = {
+    "GD": ["GD", "Guía", "Guia", "Guia Despacho"],
+    "Fecha": ["Fecha", "Date", "Fecha de Ingreso"],
+    "Proveedor": ["Proveedor", "Supplier", "Empresa"],
+    "TAG": ["TAG", "Etiqueta"],
+    "Descripcion Material": ["Descripcion Material", "Descripción Material", "Material"],
+    "Cantidad": ["Cantidad", "Quantity", "Q"]
+}
+
+# Campos del modelo que se pueden asignar en el paso de mapeo y su cabecera canónica
+CAMPOS_MAPEO = {
+    "id_guid": "GD",
+    "fecha": "Fecha",
+    "tag": "TAG",
+    "descripcion": "Descripcion Material",
+    "cantidad": "Cantidad",
+    "proveedor": "Proveedor",
+    "observacion": None,
+    "especialidad": None,
+}
+CAMPOS_OBLIGATORIOS = ["id_guid", "fecha", "tag", "descripcion", "cantidad"]
+
+
+#-------------------ARCHIVOS EN ESPERA----------------
+
+def guardar_staged(file_obj) -> str:
+    """Guarda el archivo subido en disco y devuelve el token que lo identifica."""
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    token = uuid.uuid4().hex
+    with open(ruta_staged(token), "wb") as buffer:
+        shutil.copyfileobj(file_obj, buffer)
+    return token
+
+
+def ruta_staged(token: str) -> str:
+    """Devuelve la ruta del archivo en espera, validando el token."""
+    if not _TOKEN_RE.match(token or ""):
+        raise ValueError("Token de archivo inválido.")
+    return os.path.join(UPLOAD_DIR, f"{token}.xlsx")
+
+
+def eliminar_staged(token: str) -> None:
+    """Elimina el archivo en espera asociado al token, si existe."""
+    ruta = ruta_staged(token)
+    if os.path.exists(ruta):
+        os.remove(ruta)
+
+
+def limpiar_staged(max_edad: int = STAGED_TTL_SEGUNDOS) -> int:
+    """Elimina los archivos en espera más antiguos que max_edad segundos."""
+    if not os.path.isdir(UPLOAD_DIR):
+        return 0
+    limite = time.time() - max_edad
+    eliminados = 0
+    for nombre in os.listdir(UPLOAD_DIR):
+        ruta = os.path.join(UPLOAD_DIR, nombre)
+        if nombre.endswith(".xlsx") and os.path.getmtime(ruta) < limite:
+            os.remove(ruta)
+            eliminados += 1
+    return eliminados
+
+
+#-------------------LECTURA EN STREAMING----------------
+
+def _abrir_hoja(token: str):
+    """Abre el libro en modo solo lectura (streaming) y devuelve el libro y su hoja activa."""
+    wb = load_workbook(ruta_staged(token), read_only=True, data_only=True)
+    return wb, wb.active
+
+
+def leer_cabecera(token: str, n_filas: int = 10) -> Tuple[List[str], List[list]]:
+    """Lee solo la cabecera y las primeras n_filas del archivo, sin cargar la hoja completa."""
+    wb, ws = _abrir_hoja(token)
+    try:
+        filas = ws.iter_rows(min_row=1, max_row=n_filas + 1, values_only=True)
+        cabecera = next(filas, ())
+        columnas = [str(c).strip() if c is not None else "" for c in cabecera]
+        preview = [list(fila) for fila in filas]
+        return columnas, preview
+    finally:
+        wb.close()
+
+
+def iterar_filas(token: str, mapeo: Dict[str, str]):
+    """Recorre las filas del archivo en espera y entrega un diccionario por fila con los campos mapeados."""
+    wb, ws = _abrir_hoja(token)
+    try:
+        filas = ws.iter_rows(values_only=True)
+        cabecera = [str(c).strip() if c is not None else "" for c in next(filas, ())]
+        indices = {}
+        for campo, columna in mapeo.items():
+            if columna not in cabecera:
+                raise ValueError(f"La columna '{columna}' no existe en el archivo.")
+            indices[campo] = cabecera.index(columna)
+        for fila in filas:
+            if fila is None or all(v is None for v in fila):
+                continue
+            yield {campo: (fila[i] if i < len(fila) else None) for campo, i in indices.items()}
+    finally:
+        wb.close()
+
+
+def convertir_fecha(valor) -> date:
+    """Convierte el valor de una celda en fecha (acepta fechas de Excel y texto)."""
+    if isinstance(valor, datetime):
+        return valor.date()
+    if isinstance(valor, date):
+        return valor
+    return parse(str(valor).strip()).date()
+
+
+#-------------------PERFILES DE COLUMNAS----------------
+
+def obtener_perfil(db: Session, proveedor: str) -> Optional[Dict[str, str]]:
+    """Devuelve el mapeo de columnas guardado para un proveedor."""
+    perfil = db.get(PerfilColumnas, proveedor)
+    return json.loads(perfil.mapeo) if perfil else None
+
+
+def guardar_perfil(db: Session, proveedor: str, mapeo: Dict[str, str]) -> None:
+    """Crea o actualiza el perfil de columnas de un proveedor (no hace commit)."""
+    perfil = db.get(PerfilColumnas, proveedor)
+    if perfil:
+        perfil.mapeo = json.dumps(mapeo, ensure_ascii=False)
+    else:
+        perfil = PerfilColumnas(proveedor=proveedor, mapeo=json.dumps(mapeo, ensure_ascii=False))
+    db.add(perfil)
+
+
+def alias_columnas(db: Session) -> Dict[str, List[str]]:
+    """Devuelve la tabla de alias extendida con las columnas de los perfiles guardados."""
+    alias = {k: list(v) for k, v in ALIAS_COLUMNAS.items()}
+    for perfil in db.exec(select(PerfilColumnas)).all():
+        for campo, columna in json.loads(perfil.mapeo).items():
+            canonica = CAMPOS_MAPEO.get(campo)
+            if canonica and columna and columna not in alias[canonica]:
+                alias[canonica].append(columna)
+    return alias
+
+
+def sugerir_mapeo(columnas: List[str], alias: Dict[str, List[str]], perfil: Optional[Dict[str, str]] = None) -> Dict[str, str]:
+    """Sugiere qué columna del archivo corresponde a cada campo, priorizando el perfil del proveedor."""
+    sugerido = {}
+    for campo, canonica in CAMPOS_MAPEO.items():
+        if perfil and perfil.get(campo) in columnas:
+            sugerido[campo] = perfil[campo]
+            continue
+        for equivalente in alias.get(canonica, []) if canonica else []:
+            if equivalente in columnas:
+                sugerido[campo] = equivalente
+                break
+    return sugerido
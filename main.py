@@ -1,14 +1,28 @@
 from typing import Optional
 from datetime import datetime
 import os
+import json
+import asyncio
 import logging
+from itertools import chain, groupby
 from fastapi import FastAPI, Request, Depends, HTTPException, Form, File, UploadFile
-from fastapi.responses import HTMLResponse, FileResponse
+from fastapi.responses import HTMLResponse, FileResponse, RedirectResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
+from jinja2 import FileSystemBytecodeCache
 from sqlmodel import Session, select
-from db_config import init_db, get_session
+from db_config import engine, init_db, get_session
 from models import Guia, Item
+from importacion import (
+    CAMPOS_OBLIGATORIOS, alias_columnas, convertir_fecha, eliminar_staged,
+    guardar_perfil, guardar_staged, iterar_filas, leer_cabecera, limpiar_staged,
+    obtener_perfil, sugerir_mapeo,
+)
+from archivo import buscar_guia_archivada, leer_archivo
+from autocompletado import CAMPOS_AUTOCOMPLETADO, construir_indices, indexar, indices, valores_autocompletado
+from cambios import al_confirmar, cambios_desde, cargar_filas, cursor_actual, ultimas_operaciones
+from borrado import LOTE_BORRADO, eliminar_guias, vaciar_todo
+from eventos import calcular_estadisticas, difusor
 import pandas as pd
 from dateutil.parser import parse  # Importar el analizador de fechas
 from sqlalchemy import text  # Importar text para consultas SQL sin procesar
@@ -34,6 +48,43 @@ app = FastAPI(
 app.mount("/static", StaticFiles(directory="static"), name="static")
 templates = Jinja2Templates(directory="templates")
 
+# Caché persistente del bytecode de las plantillas: evita recompilarlas en cada arranque o worker
+JINJA_CACHE_DIR = os.getenv("JINJA_CACHE_DIR", ".jinja_cache")
+os.makedirs(JINJA_CACHE_DIR, exist_ok=True)
+templates.env.bytecode_cache = FileSystemBytecodeCache(JINJA_CACHE_DIR)
+
+LOTE_STREAMING = 500  # Filas leídas por lote al renderizar por partes
+STREAM_BUFFER = 64  # Fragmentos de plantilla agrupados en cada envío
+
+
+def render_streaming(nombre: str, request: Request, construir_contexto):
+    """Renderiza la plantilla por partes mientras se leen las filas de la base de datos.
+
+    `construir_contexto` recibe una sesión propia (abierta durante toda la respuesta) y devuelve
+    el contexto con iteradores de filas en lugar de listas.
+    """
+    plantilla = templates.get_template(nombre)
+
+    def generar():
+        with Session(engine) as db:
+            flujo = plantilla.stream(request=request, **construir_contexto(db))
+            flujo.enable_buffering(STREAM_BUFFER)
+            yield from flujo
+
+    return StreamingResponse(generar(), media_type="text/html; charset=utf-8")
+
+
+@app.on_event("startup")
+def cargar_indices_autocompletado():
+    """Construye los índices de autocompletado al iniciar la aplicación."""
+    with Session(engine) as session:
+        construir_indices(session)
+    logger.info("Índices de autocompletado construidos: " + ", ".join(f"{c}={len(i)}" for c, i in indices.items()))
+
+
+# Avisar al dashboard en vivo cada vez que se confirman cambios en guías o ítems
+al_confirmar(difusor.notificar)
+
 #-------------------INICIO DE PAGINA WEB----------------
 
 @app.get("/", response_class=HTMLResponse)
@@ -89,7 +140,9 @@ async def guardar_guia_manual(
             especialidad=especialidad
         )
         db.add(item)
+        valores = valores_autocompletado([guia], [item])
         db.commit()
+        indexar(valores)
         logger.info(f"Guía e ítem guardados correctamente: id_guid={id_guid}, tag={tag}")
         return {"message": "Guía guardada correctamente."}
     except HTTPException as http_exc:
@@ -100,115 +153,228 @@ async def guardar_guia_manual(
         raise HTTPException(status_code=500, detail=f"Error inesperado al guardar la guía: {str(e)}")
 
 
+#-------------------AUTOCOMPLETADO----------------
+
+@app.get("/api/autocompletar", response_class=JSONResponse)
+def autocompletar(campo: str, q: str, k: int = 10):
+    """Devuelve sugerencias por prefijo para TAG, descripción, especialidad o proveedor."""
+    if campo not in CAMPOS_AUTOCOMPLETADO:
+        raise HTTPException(status_code=400, detail=f"Campo no soportado: {campo}")
+    sugerencias = indices[campo].sugerir(q, k)
+    return [{"valor": valor, "frecuencia": frecuencia} for valor, frecuencia in sugerencias]
+
+
+#-------------------DASHBOARD----------------
+
+@app.get("/dashboard", response_class=HTMLResponse)
+def dashboard(request: Request):
+    """Muestra el dashboard de ítems por especialidad."""
+    return templates.TemplateResponse("dashboard.html", {"request": request})
+
+
+@app.get("/api/stats", response_class=JSONResponse)
+def estadisticas():
+    """Devuelve la cantidad de ítems por especialidad."""
+    return calcular_estadisticas()["especialidades"]
+
+
+@app.get("/api/stats/stream")
+async def estadisticas_en_vivo(request: Request):
+    """Envía por server-sent events el estado inicial y luego solo los cambios de las estadísticas."""
+
+    async def generar():
+        cola = await difusor.suscribir()
+        try:
+            while True:
+                try:
+                    evento = await asyncio.wait_for(cola.get(), timeout=15)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        break
+                    yield ": ping\n\n"  # Mantiene viva la conexión
+                    continue
+                if evento is None:
+                    # Cliente demasiado lento: el navegador se reconecta y recibe el estado completo
+                    break
+                tipo, datos = evento
+                yield f"event: {tipo}\ndata: {json.dumps(datos, ensure_ascii=False)}\n\n"
+        finally:
+            difusor.desuscribir(cola)
+
+    return StreamingResponse(generar(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+
 #-------------------LINK EXPORTAR A EXCEL----------------
 
+FORMATOS_EXPORTACION = ["xlsx", "csv", "parquet"]
+COLUMNAS_EXPORTACION = ["Número de Guía", "Descripción", "Cantidad", "TAG", "Fecha", "Proveedor", "Especialidad", "Observación"]
+COLUMNAS_DELTA = ["ID Ítem", "Operación"]  # Columnas extra de la exportación incremental
+OPERACIONES_BORRADO = ("delete", "archivado", "vaciado")
+LOTE_CLAVES = 500  # Claves por consulta IN en la exportación incremental
+
 
 @app.get("/export-excel/")
-async def exportar_excel(db: Session = Depends(get_session)):
-    """Exporta los datos de las tablas Guia e Item a un archivo Excel en una sola hoja."""
+async def exportar_excel(
+    formato: str = "xlsx",
+    incluir_archivo: bool = False,
+    desde: Optional[int] = None,
+    db: Session = Depends(get_session)
+):
+    """Exporta los datos de las tablas Guia e Item a un archivo Excel (o CSV/Parquet) en una sola hoja.
+
+    Con `desde` solo se exportan los ítems cambiados después de ese cursor del registro de cambios,
+    con las columnas "ID Ítem" y "Operación". Las guías e ítems eliminados, archivados o vaciados
+    aparecen primero, solo con su clave y la operación. La cabecera X-Cursor indica el cursor
+    a usar en la siguiente exportación incremental.
+    """
     try:
+        if formato not in FORMATOS_EXPORTACION:
+            raise HTTPException(status_code=400, detail=f"Formato no soportado: {formato}")
+
+        # El cursor se toma antes de consultar: un cambio concurrente se vuelve a exportar la próxima vez
+        cursor = cursor_actual(db)
+
         # Consultar los datos de las tablas Guia e Item
-        guias = db.exec(select(Guia)).all()
-        items = db.exec(select(Item)).all()
+        consulta = select(Item, Guia).join(Guia, Item.id_guid == Guia.id_guid)
+        consultas = [consulta]
+        data = []
+        if desde is not None:
+            # Solo se consideran los cambios hasta el cursor; los posteriores salen en la próxima exportación
+            operaciones = ultimas_operaciones(db, desde, cursor)
+
+            # Las filas que ya no existen se informan primero, para aplicarlas antes que las altas
+            for (tabla, clave), operacion in operaciones.items():
+                if operacion in OPERACIONES_BORRADO:
+                    data.append({
+                        "Número de Guía": clave if tabla == "guia" else None,
+                        "ID Ítem": clave if tabla == "item" else None,
+                        "Operación": operacion,
+                    })
+
+            # Las filas vigentes se buscan por clave, por tramos: usan la clave primaria de item y
+            # el índice de item.id_guid en lugar de recorrer la tabla completa
+            vigentes = [(tabla, clave) for (tabla, clave), operacion in operaciones.items() if operacion not in OPERACIONES_BORRADO]
+            claves_item = [int(clave) for tabla, clave in vigentes if tabla == "item"]
+            claves_guia = [clave for tabla, clave in vigentes if tabla == "guia"]
+            consultas = [
+                consulta.where(Item.id.in_(claves_item[i:i + LOTE_CLAVES]))
+                for i in range(0, len(claves_item), LOTE_CLAVES)
+            ] + [
+                consulta.where(Item.id_guid.in_(claves_guia[i:i + LOTE_CLAVES]))
+                for i in range(0, len(claves_guia), LOTE_CLAVES)
+            ]
+            exportados = set()
 
         # Combinar los datos de Guia e Item en un solo DataFrame
-        data = []
-        for item in items:
-            guia = next((g for g in guias if g.id_guid == item.id_guid), None)
-            if guia:
-                data.append({
-                    "Número de Guía": guia.id_guid,
-                    "Descripción": item.descripcion,
-                    "Cantidad": item.cantidad,
-                    "TAG": item.tag,
-                    "Fecha": guia.fecha,
-                    "Proveedor": guia.proveedor,
-                    "Especialidad": item.especialidad if item.especialidad else "No especificada",
-                    "Observación": guia.observacion if guia.observacion else "Sin observación"
-                })
+        for item, guia in chain.from_iterable(db.exec(c) for c in consultas):
+            fila = {
+                "Número de Guía": guia.id_guid,
+                "Descripción": item.descripcion,
+                "Cantidad": item.cantidad,
+                "TAG": item.tag,
+                "Fecha": guia.fecha,
+                "Proveedor": guia.proveedor,
+                "Especialidad": item.especialidad if item.especialidad else "No especificada",
+                "Observación": guia.observacion if guia.observacion else "Sin observación"
+            }
+            if desde is not None:
+                # Un ítem cambiado de una guía cambiada aparece en las dos búsquedas
+                if item.id in exportados:
+                    continue
+                exportados.add(item.id)
+                fila["ID Ítem"] = str(item.id)
+                fila["Operación"] = operaciones.get(("item", str(item.id)), "update")
+            data.append(fila)
 
         # Crear un DataFrame con los datos combinados
-        df = pd.DataFrame(data)
+        columnas = COLUMNAS_EXPORTACION + COLUMNAS_DELTA if desde is not None else COLUMNAS_EXPORTACION
+        df = pd.DataFrame(data, columns=columnas).astype({"Cantidad": "Int64"})
+
+        # Agregar las guías archivadas si se solicitan (no aplica a la exportación incremental)
+        if incluir_archivo and desde is None:
+            archivadas = leer_archivo().dropna(subset=["tag"])
+            archivadas = archivadas.rename(columns=dict(zip(
+                ["id_guid", "descripcion", "cantidad", "tag", "fecha", "proveedor", "especialidad", "observacion"],
+                COLUMNAS_EXPORTACION
+            )))
+            archivadas["Especialidad"] = archivadas["Especialidad"].fillna("No especificada")
+            archivadas["Observación"] = archivadas["Observación"].fillna("Sin observación")
+            df = pd.concat([df, archivadas[COLUMNAS_EXPORTACION]], ignore_index=True)
+
+        headers = {"X-Cursor": str(cursor)}
+        if formato == "parquet":
+            # Instantánea columnar, sin pasar por Excel
+            file_path = "exported_data.parquet"
+            df.to_parquet(file_path, index=False)
+            return FileResponse(file_path, media_type="application/vnd.apache.parquet", filename="exported_data.parquet", headers=headers)
+
+        if formato == "csv":
+            file_path = "exported_data.csv"
+            df.to_csv(file_path, index=False)
+            return FileResponse(file_path, media_type="text/csv", filename="exported_data.csv", headers=headers)
 
         # Crear un archivo Excel con una sola hoja
         file_path = "exported_data.xlsx"
         df.to_excel(file_path, index=False, sheet_name="Datos")
 
         # Enviar el archivo como respuesta
-        return FileResponse(file_path, media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", filename="exported_data.xlsx")
+        return FileResponse(file_path, media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", filename="exported_data.xlsx", headers=headers)
+    except HTTPException as http_exc:
+        raise http_exc
     except Exception as e:
         logger.error(f"Error al exportar datos a Excel: {e}")
         raise HTTPException(status_code=500, detail="Error al exportar datos a Excel.")
 
 
 
-#-------------------LINK IMPORTAR A EXCEL----------------
+#-------------------CAMBIOS INCREMENTALES----------------
 
+@app.get("/api/changes")
+def listar_cambios(since: int = 0, limite: int = 1000):
+    """Devuelve en NDJSON las guías e ítems cambiados después del cursor `since`, una página a la vez.
 
-@app.get("/importar-excel", response_class=HTMLResponse)
-def formulario_importar_excel(request: Request):
-    """Muestra el formulario para importar guías desde un archivo Excel."""
-    return templates.TemplateResponse("importar_excel.html", {"request": request})
-
+    La cabecera X-Next-Cursor indica el cursor de la siguiente página y X-Has-More si quedan cambios.
+    """
+    if since < 0 or not 1 <= limite <= 10000:
+        raise HTTPException(status_code=400, detail="Parámetros de paginación inválidos.")
 
-#-------------------PROCESAR EXCEL----------------
+    with Session(engine) as db:
+        cambios, hay_mas = cambios_desde(db, since, limite)
+    siguiente = max((c.id for c in cambios), default=since)
 
+    def generar():
+        # Las filas se cargan por lotes mientras se envía la respuesta
+        with Session(engine) as db:
+            for i in range(0, len(cambios), 500):
+                lote = cambios[i:i + 500]
+                filas = cargar_filas(db, lote)
+                for cambio in lote:
+                    yield json.dumps({
+                        "cursor": cambio.id,
+                        "tabla": cambio.tabla,
+                        "clave": cambio.clave,
+                        "operacion": cambio.operacion,
+                        "fecha": cambio.fecha.isoformat(),
+                        "datos": filas.get((cambio.tabla, cambio.clave)),
+                    }, ensure_ascii=False) + "\n"
 
-from dateutil.parser import parse  # Importar el analizador de fechas
+    return StreamingResponse(
+        generar(),
+        media_type="application/x-ndjson",
+        headers={"X-Next-Cursor": str(siguiente), "X-Has-More": "true" if hay_mas else "false"}
+    )
 
-@app.post("/procesar-excel")
-async def procesar_excel(file: UploadFile = File(...), db: Session = Depends(get_session)):
-    """Procesa un archivo Excel y guarda los datos en la base de datos."""
-    try:
-        if not file.filename.endswith(".xlsx"):
-            raise HTTPException(status_code=400, detail="El archivo debe ser un Excel (.xlsx)")
-
-        # Leer el archivo Excel
-        df = pd.read_excel(file.file)
 
-        # Cabeceras requeridas
-        columnas_requeridas = ["GD", "Fecha", "Proveedor", "TAG", "Descripcion Material", "Cantidad"]
-        for col in columnas_requeridas:
-            if col not in df.columns:
-                raise HTTPException(status_code=400, detail=f"Falta la columna requerida: {col}")
+#-------------------LINK IMPORTAR A EXCEL----------------
 
-        # Procesar cada fila del archivo
-        for _, row in df.iterrows():
-            id_guid = str(row["GD"]).strip()
-            fecha = datetime.strptime(str(row["Fecha"]).strip(), "%Y-%m-%d").date()
-            proveedor = row.get("Proveedor", "").strip()
-            tag = row.get("TAG", "").strip()
-            descripcion = row.get("Descripcion Material", "").strip()
-            cantidad = int(row.get("Cantidad", 0))
-
-            # Verificar si el número de guía ya existe
-            guia = db.exec(select(Guia).where(Guia.id_guid == id_guid)).first()
-            if not guia:
-                # Crear una nueva guía si no existe
-                guia = Guia(
-                    id_guid=id_guid,
-                    fecha=fecha,
-                    proveedor=proveedor
-                )
-                db.add(guia)
 
-            # Crear un nuevo ítem asociado a la guía
-            item = Item(
-                tag=tag,
-                descripcion=descripcion,
-                cantidad=cantidad,
-                id_guid=id_guid
-            )
-            db.add(item)
+@app.get("/importar-excel", response_class=HTMLResponse)
+def formulario_importar_excel(request: Request):
+    """Muestra el formulario para importar guías desde un archivo Excel."""
+    return templates.TemplateResponse("importar_excel.html", {"request": request})
 
-        db.commit()
-        logger.info("Archivo procesado y datos guardados correctamente.")
-        return {"message": "Archivo procesado y datos guardados correctamente."}
-    except Exception as e:
-        logger.error(f"Error al procesar el archivo Excel: {e}")
-        raise HTTPException(status_code=500, detail=f"Error al procesar el archivo: {str(e)}")    
 
-#-------------------PROCESAR EL  EXCEL----------------
+#-------------------PROCESAR EXCEL----------------
 
 
 @app.post("/procesar-excel")
@@ -221,15 +387,8 @@ async def procesar_excel(file: UploadFile = File(...), db: Session = Depends(get
         # Leer el archivo Excel
         df = pd.read_excel(file.file)
 
-        # Cabeceras requeridas y sus equivalentes
-        columnas_requeridas = {
-            "GD": ["GD", "Guía", "Guia", "Guia Despacho"],
-            "Fecha": ["Fecha", "Date", "Fecha de Ingreso"],
-            "Proveedor": ["Proveedor", "Supplier", "Empresa"],
-            "TAG": ["TAG", "Etiqueta"],
-            "Descripcion Material": ["Descripcion Material", "Descripción Material", "Material"],
-            "Cantidad": ["Cantidad", "Quantity", "Q"]
-        }
+        # Cabeceras requeridas y sus equivalentes (incluye las de los perfiles de proveedor)
+        columnas_requeridas = alias_columnas(db)
 
         # Mapear las columnas del archivo a las requeridas
         columnas_mapeadas = {}
@@ -248,7 +407,7 @@ async def procesar_excel(file: UploadFile = File(...), db: Session = Depends(get
             )
 
         # Renombrar las columnas del DataFrame según las requeridas
-        df = df.rename(columns=columnas_mapeadas)
+        df = df.rename(columns={original: requerida for requerida, original in columnas_mapeadas.items()})
 
         # Manejar celdas vacías
         df = df.fillna({
@@ -264,6 +423,7 @@ async def procesar_excel(file: UploadFile = File(...), db: Session = Depends(get
         df["Fecha"] = df["Fecha"].astype(str)
 
         # Procesar cada fila del archivo
+        guias_nuevas, items_nuevos = [], []
         for _, row in df.iterrows():
             # Manejar el formato de fecha automáticamente
             try:
@@ -280,6 +440,7 @@ async def procesar_excel(file: UploadFile = File(...), db: Session = Depends(get
                     proveedor=row.get('Proveedor', None)
                 )
                 db.add(guia)
+                guias_nuevas.append(guia)
 
             item = Item(
                 tag=row['TAG'],
@@ -288,37 +449,283 @@ async def procesar_excel(file: UploadFile = File(...), db: Session = Depends(get
                 id_guid=gid
             )
             db.add(item)
+            items_nuevos.append(item)
 
+        # Los valores se leen antes del commit, que expira los objetos
+        valores = valores_autocompletado(guias_nuevas, items_nuevos)
         db.commit()
+        indexar(valores)
         return {"message": "Archivo procesado y datos guardados correctamente."}
+    except HTTPException as http_exc:
+        logger.error(f"Error al procesar el archivo Excel: {http_exc.detail}")
+        raise http_exc
     except Exception as e:
         logger.error(f"Error al procesar el archivo Excel: {e}")
         raise HTTPException(status_code=500, detail=f"Error al procesar el archivo: {str(e)}")
 
+#-------------------IMPORTAR EXCEL CON MAPEO DE COLUMNAS----------------
+
+PREVIEW_FILAS = 10  # Filas que se muestran en el paso de mapeo
+
+
+@app.get("/upload-excel", response_class=HTMLResponse)
+def formulario_upload_excel(request: Request):
+    """Muestra el primer paso de la importación con mapeo de columnas."""
+    return templates.TemplateResponse("upload_form.html", {"request": request})
+
+
+@app.post("/upload-excel-preview", response_class=HTMLResponse)
+async def upload_excel_preview(
+    request: Request,
+    file: UploadFile = File(...),
+    proveedor: Optional[str] = Form(None),
+    db: Session = Depends(get_session)
+):
+    """Guarda el archivo en espera y muestra la cabecera y las primeras filas para asignar columnas."""
+    try:
+        if not file.filename.endswith(".xlsx"):
+            raise HTTPException(status_code=400, detail="El archivo debe ser un Excel (.xlsx)")
+
+        limpiar_staged()
+        token = guardar_staged(file.file)
+
+        # Leer solo la cabecera y unas pocas filas, sin cargar la hoja completa
+        try:
+            columnas, preview = leer_cabecera(token, PREVIEW_FILAS)
+        except Exception as e:
+            eliminar_staged(token)
+            raise HTTPException(status_code=400, detail=f"No se pudo leer el archivo Excel: {e}")
+        if not any(columnas):
+            eliminar_staged(token)
+            raise HTTPException(status_code=400, detail="El archivo no tiene cabecera.")
+
+        proveedor = proveedor.strip() if proveedor else None
+        perfil = obtener_perfil(db, proveedor) if proveedor else None
+        sugerido = sugerir_mapeo(columnas, alias_columnas(db), perfil)
+
+        logger.info(f"Archivo en espera {token} ({file.filename}) con {len(columnas)} columnas.")
+        return templates.TemplateResponse("upload_mapping.html", {
+            "request": request,
+            "token": token,
+            "columns": columnas,
+            "preview": preview,
+            "sugerido": sugerido,
+            "proveedor": proveedor or "",
+        })
+    except HTTPException as http_exc:
+        logger.error(f"Error al previsualizar el archivo Excel: {http_exc.detail}")
+        raise http_exc
+    except Exception as e:
+        logger.error(f"Error inesperado al previsualizar el archivo Excel: {e}")
+        raise HTTPException(status_code=500, detail=f"Error al previsualizar el archivo: {str(e)}")
+
+
+@app.post("/upload-excel")
+async def upload_excel(
+    token: str = Form(...),
+    col_id_guid: str = Form(...),
+    col_fecha: str = Form(...),
+    col_tag: str = Form(...),
+    col_descripcion: str = Form(...),
+    col_cantidad: str = Form(...),
+    col_proveedor: Optional[str] = Form(None),
+    col_observacion: Optional[str] = Form(None),
+    col_especialidad: Optional[str] = Form(None),
+    proveedor: Optional[str] = Form(None),
+    guardar_perfil_proveedor: bool = Form(False),
+    db: Session = Depends(get_session)
+):
+    """Importa el archivo en espera usando el mapeo de columnas elegido, sin volver a subirlo."""
+    try:
+        mapeo = {
+            "id_guid": col_id_guid,
+            "fecha": col_fecha,
+            "tag": col_tag,
+            "descripcion": col_descripcion,
+            "cantidad": col_cantidad,
+            "proveedor": col_proveedor,
+            "observacion": col_observacion,
+            "especialidad": col_especialidad,
+        }
+        mapeo = {campo: col for campo, col in mapeo.items() if col}
+        faltantes = [campo for campo in CAMPOS_OBLIGATORIOS if campo not in mapeo]
+        if faltantes:
+            raise HTTPException(status_code=400, detail=f"Faltan columnas requeridas: {', '.join(faltantes)}")
+
+        proveedor = proveedor.strip() if proveedor else None
+        guias_vistas = set()
+        guias_nuevas, items_nuevos = [], []
+        for fila in iterar_filas(token, mapeo):
+            gid = str(fila["id_guid"] if fila["id_guid"] is not None else "SIN_GD").strip()
+            try:
+                fecha = convertir_fecha(fila["fecha"] if fila["fecha"] is not None else "01/01/1900")
+            except (ValueError, OverflowError):
+                raise HTTPException(status_code=400, detail=f"Formato de fecha inválido: {fila['fecha']}")
+
+            # Consultar cada guía una sola vez por importación
+            if gid not in guias_vistas:
+                if not db.get(Guia, gid):
+                    guia = Guia(
+                        id_guid=gid,
+                        fecha=fecha,
+                        proveedor=fila.get("proveedor") or proveedor,
+                        observacion=fila.get("observacion")
+                    )
+                    db.add(guia)
+                    guias_nuevas.append(guia)
+                guias_vistas.add(gid)
+
+            item = Item(
+                tag=str(fila["tag"] if fila["tag"] is not None else "SIN_TAG").strip(),
+                descripcion=str(fila["descripcion"] if fila["descripcion"] is not None else "SIN_DESCRIPCION").strip(),
+                cantidad=int(float(fila["cantidad"] or 0)),
+                id_guid=gid,
+                especialidad=fila.get("especialidad")
+            )
+            db.add(item)
+            items_nuevos.append(item)
+
+        if proveedor and guardar_perfil_proveedor:
+            guardar_perfil(db, proveedor, mapeo)
+
+        # Los valores se leen antes del commit, que expira los objetos
+        valores = valores_autocompletado(guias_nuevas, items_nuevos)
+        db.commit()
+        indexar(valores)
+        eliminar_staged(token)
+        logger.info(f"Archivo en espera {token} importado: {len(items_nuevos)} ítems, {len(guias_vistas)} guías.")
+        return {"message": f"Archivo procesado y datos guardados correctamente: {len(items_nuevos)} ítems."}
+    except HTTPException as http_exc:
+        logger.error(f"Error al importar el archivo en espera: {http_exc.detail}")
+        raise http_exc
+    except ValueError as e:
+        logger.error(f"Error al importar el archivo en espera: {e}")
+        raise HTTPException(status_code=400, detail=str(e))
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="El archivo en espera no existe o ya fue importado.")
+    except Exception as e:
+        logger.error(f"Error inesperado al importar el archivo en espera: {e}")
+        raise HTTPException(status_code=500, detail=f"Error al procesar el archivo: {str(e)}")
+
 #-------------------VACIAR LA BASE DE DATOS ----------------
 
+# Contraseña requerida para los borrados masivos
+PASSWORD = "Radiohead5"  # Cambia esta contraseña por una más segura
+
 
 @app.get("/vaciar-bd", response_class=JSONResponse)
 async def vaciar_base_datos(password: str, db: Session = Depends(get_session)):
     """Elimina todos los registros de las tablas Guia e Item si se proporciona la contraseña correcta."""
     try:
-        # Contraseña requerida
-        PASSWORD = "Radiohead5"  # Cambia esta contraseña por una más segura
-
         # Validar la contraseña
         if password != PASSWORD:
             raise HTTPException(status_code=403, detail="Acceso denegado. Contraseña incorrecta.")
 
-        # Eliminar todos los registros de las tablas
-        db.exec(text("DELETE FROM item;"))
-        db.exec(text("DELETE FROM guia;"))
-        db.commit()
-        logger.info("Base de datos vaciada correctamente.")
-        return {"message": "Base de datos vaciada correctamente."}
+        # Eliminar todos los registros de las tablas (truncado rápido) y los PDFs
+        resultado = vaciar_todo(db)
+        construir_indices(db)
+        logger.info(f"Base de datos vaciada correctamente: {resultado}")
+        return {"message": "Base de datos vaciada correctamente.", **resultado}
+    except HTTPException as http_exc:
+        logger.error(f"Error al vaciar la base de datos: {http_exc.detail}")
+        raise http_exc
     except Exception as e:
         logger.error(f"Error al vaciar la base de datos: {e}")
         raise HTTPException(status_code=500, detail=f"Error al vaciar la base de datos: {str(e)}")
-    
+
+
+#-------------------ELIMINAR GUIAS----------------
+
+def _guias_con_items(db: Session):
+    """Recorre las guías (de la más reciente a la más antigua) con sus ítems en una sola consulta leída por lotes.
+
+    El orden es el del índice (fecha, id_guid) y los ítems de cada guía se buscan con el índice
+    de item.id_guid, así la base no tiene que ordenar el listado antes de entregar la primera fila.
+    """
+    consulta = (
+        select(Guia, Item)
+        .join(Item, Item.id_guid == Guia.id_guid, isouter=True)
+        .order_by(Guia.fecha.desc(), Guia.id_guid.desc())
+        .execution_options(yield_per=LOTE_STREAMING)
+    )
+    for _, grupo in groupby(db.exec(consulta), key=lambda fila: fila[0].id_guid):
+        primera = next(grupo)
+        guia = primera[0]
+        yield {
+            "id_guid": guia.id_guid,
+            "fecha": guia.fecha,
+            "proveedor": guia.proveedor,
+            # La plantilla consume los ítems de cada guía antes de pasar a la siguiente
+            "items": (item for _, item in chain([primera], grupo) if item is not None),
+        }
+
+
+@app.get("/guias", response_class=HTMLResponse)
+def listar_guias(request: Request):
+    """Muestra el listado de guías con sus ítems, enviando la página a medida que se lee."""
+    return render_streaming("guias_list.html", request, lambda db: {"guias": _guias_con_items(db)})
+
+
+@app.get("/delete-guia/{id_guid}", response_class=HTMLResponse)
+def confirmar_eliminar_guia(id_guid: str, request: Request, db: Session = Depends(get_session)):
+    """Pide confirmación antes de eliminar una guía."""
+    guia = db.get(Guia, id_guid)
+    if not guia:
+        raise HTTPException(status_code=404, detail="Guía no encontrada.")
+    return templates.TemplateResponse("confirm_delete.html", {"request": request, "guia": guia})
+
+
+@app.post("/delete-guia/{id_guid}")
+def eliminar_guia(id_guid: str, db: Session = Depends(get_session)):
+    """Elimina una guía con sus ítems y su PDF, y vuelve al listado."""
+    try:
+        resultado = list(eliminar_guias(db, id_guid=id_guid))[-1]
+        if not resultado["guias"]:
+            raise HTTPException(status_code=404, detail="Guía no encontrada.")
+        logger.info(f"Guía {id_guid} eliminada: {resultado}")
+        return RedirectResponse(url="/guias", status_code=303)
+    except HTTPException as http_exc:
+        logger.error(f"Error al eliminar la guía: {http_exc.detail}")
+        raise http_exc
+    except Exception as e:
+        logger.error(f"Error inesperado al eliminar la guía: {e}")
+        raise HTTPException(status_code=500, detail=f"Error inesperado al eliminar la guía: {str(e)}")
+
+
+@app.post("/eliminar-guias")
+def eliminar_guias_masivo(
+    password: str = Form(...),
+    desde: Optional[str] = Form(None),
+    hasta: Optional[str] = Form(None),
+    proveedor: Optional[str] = Form(None),
+    lote: int = Form(LOTE_BORRADO)
+):
+    """Elimina por lotes las guías de un rango de fechas y/o proveedor, informando el progreso en NDJSON."""
+    if password != PASSWORD:
+        raise HTTPException(status_code=403, detail="Acceso denegado. Contraseña incorrecta.")
+    try:
+        desde_obj = datetime.strptime(desde, "%Y-%m-%d").date() if desde else None
+        hasta_obj = datetime.strptime(hasta, "%Y-%m-%d").date() if hasta else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Las fechas deben tener el formato YYYY-MM-DD.")
+    if not (desde_obj or hasta_obj or proveedor):
+        raise HTTPException(status_code=400, detail="Indique un rango de fechas o un proveedor; para borrar todo use /vaciar-bd.")
+    if not 1 <= lote <= 5000:
+        raise HTTPException(status_code=400, detail="El tamaño de lote debe estar entre 1 y 5000.")
+
+    def generar():
+        # Sesión propia: la respuesta se envía mientras avanza el borrado
+        with Session(engine) as db:
+            try:
+                for progreso in eliminar_guias(db, desde=desde_obj, hasta=hasta_obj, proveedor=proveedor, lote=lote):
+                    yield json.dumps(progreso) + "\n"
+            except Exception as e:
+                logger.error(f"Error durante el borrado por lotes: {e}")
+                yield json.dumps({"error": str(e)}, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(generar(), media_type="application/x-ndjson")
+
+
 #-------------------ADJUNTAR PDF----------------
 
 @app.get("/adjuntar-pdf", response_class=HTMLResponse)
@@ -368,7 +775,7 @@ async def ver_pdf(id_guid: str):
 #-------------------DETALLE DE GUIA CONSULTAR----------------
 
 @app.get("/detalle-guia", response_class=HTMLResponse)
-async def detalle_guia(id_guid: str, request: Request, db: Session = Depends(get_session)):
+async def detalle_guia(id_guid: str, request: Request, incluir_archivo: bool = False, db: Session = Depends(get_session)):
     """Devuelve el detalle de una guía por su número en formato HTML."""
     try:
         # Limpiar el número de guía (eliminar espacios adicionales)
@@ -380,31 +787,38 @@ async def detalle_guia(id_guid: str, request: Request, db: Session = Depends(get
 
         # Buscar la guía en la base de datos
         guia = db.exec(select(Guia).where(Guia.id_guid == id_guid)).first()
+        items = None  # Los ítems de la base se leen por lotes mientras se envía la página
+        if not guia and incluir_archivo:
+            # Buscar la guía en el archivo histórico
+            guia, items = buscar_guia_archivada(id_guid)
         if not guia:
             raise HTTPException(status_code=404, detail="Guía no encontrada.")
 
-        # Obtener los ítems asociados a la guía
-        items = db.exec(select(Item).where(Item.id_guid == id_guid)).all()
-
         # Construir la respuesta
         detalle = {
             "Número de Guía": guia.id_guid,
             "Fecha": guia.fecha,
             "Proveedor": guia.proveedor,
             "Observación": guia.observacion if guia.observacion else "Sin observación",
-            "Ítems": [
+        }
+
+        def contexto(db_stream: Session):
+            filas = items if items is not None else db_stream.exec(
+                select(Item).where(Item.id_guid == id_guid).order_by(Item.id).execution_options(yield_per=LOTE_STREAMING)
+            )
+            detalle["Ítems"] = (
                 {
                     "TAG": item.tag,
                     "Descripción": item.descripcion,
                     "Cantidad": item.cantidad,
                     "Especialidad": item.especialidad if item.especialidad else "No especificada",
                 }
-                for item in items
-            ],
-        }
+                for item in filas
+            )
+            return {"detalle": detalle}
 
         logger.info(f"Detalle de la guía {id_guid} obtenido correctamente.")
-        return templates.TemplateResponse("detalle_guia.html", {"request": request, "detalle": detalle})
+        return render_streaming("detalle_guia.html", request, contexto)
     except HTTPException as http_exc:
         logger.error(f"HTTP error al obtener el detalle de la guía: {http_exc.detail}")
         raise http_exc
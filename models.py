@@ -1,19 +1,42 @@
 from typing import Optional, List
-from datetime import date
+from datetime import date, datetime, timezone
+from sqlalchemy import Index
 from sqlmodel import SQLModel, Field, Relationship
 
+def ahora_utc() -> datetime:
+    """Fecha y hora actual en UTC, usada para las marcas de tiempo."""
+    return datetime.now(timezone.utc)
+
 class Item(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
     tag: str
     descripcion: str
     cantidad: int
     especialidad: Optional[str] = None
-    id_guid: str = Field(foreign_key="guia.id_guid")
+    id_guid: str = Field(foreign_key="guia.id_guid", index=True)  # Ítems de una guía sin recorrer la tabla
+    creado: Optional[datetime] = Field(default_factory=ahora_utc)
+    actualizado: Optional[datetime] = Field(default_factory=ahora_utc)
     guia: Optional["Guia"] = Relationship(back_populates="items")  # Relación con Guia
 
 class Guia(SQLModel, table=True):
+    # Listado de guías de la más reciente a la más antigua sin ordenar en memoria
+    __table_args__ = (Index("ix_guia_fecha_id_guid", "fecha", "id_guid"),)
+
     id_guid: str = Field(primary_key=True)
     fecha: date
     proveedor: Optional[str] = None
     observacion: Optional[str] = None
-    items: List[Item] = Relationship(back_populates="guia")  # Relación con Item
\ No newline at end of file
+    creado: Optional[datetime] = Field(default_factory=ahora_utc)
+    actualizado: Optional[datetime] = Field(default_factory=ahora_utc)
+    items: List[Item] = Relationship(back_populates="guia")  # Relación con Item
+
+class PerfilColumnas(SQLModel, table=True):
+    proveedor: str = Field(primary_key=True)
+    mapeo: str  # JSON: campo del modelo -> cabecera de la columna en el Excel del proveedor
+
+class Cambio(SQLModel, table=True):
+    id: Optional[int] = Field(default=None, primary_key=True)  # Cursor monótono del registro de cambios
+    tabla: str  # "guia" o "item"
+    clave: str  # id_guid de la guía o id del ítem
+    operacion: str  # "insert", "update", "delete", "archivado" o "vaciado"
+    fecha: datetime = Field(default_factory=ahora_utc)
@@ -0,0 +1,32 @@
+// Autocompletado por prefijo para los campos con atributo data-autocompletar="<campo>"
+document.querySelectorAll('input[data-autocompletar]').forEach(input => {
+  const campo = input.dataset.autocompletar;
+  const lista = document.createElement('datalist');
+  lista.id = 'sugerencias-' + (input.id || input.name);
+  input.setAttribute('list', lista.id);
+  input.setAttribute('autocomplete', 'off');
+  input.after(lista);
+
+  let temporizador;
+  input.addEventListener('input', () => {
+    clearTimeout(temporizador);
+    const q = input.value.trim();
+    if (!q) {
+      lista.innerHTML = '';
+      return;
+    }
+    temporizador = setTimeout(() => {
+      fetch(`/api/autocompletar?campo=${encodeURIComponent(campo)}&q=${encodeURIComponent(q)}&k=10`)
+        .then(res => res.ok ? res.json() : [])
+        .then(sugerencias => {
+          lista.innerHTML = '';
+          sugerencias.forEach(s => {
+            const opcion = document.createElement('option');
+            opcion.value = s.valor;
+            lista.appendChild(opcion);
+          });
+        })
+        .catch(error => console.error(error));
+    }, 150);
+  });
+});